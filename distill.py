@@ -0,0 +1,223 @@
+# distill.py
+"""
+LLM 위험 판단 증류(distillation).
+
+streamlit_app.py가 PAYSHIELD_DECISION_LOG 경로에 남긴 (피처 → risk_score/bucket) 로그로
+작은 로컬 모델을 학습합니다.
+  - 버킷: 다항 로지스틱 회귀 (확률 = 신뢰도)
+  - 점수: 릿지 선형 회귀 (예측 버킷 구간으로 클램프)
+결과는 가중치만 담은 JSON 아티팩트로 저장하며, DistilledScorer는 표준 라이브러리만으로
+불러와 수 마이크로초 안에 점수를 냅니다. numpy는 학습할 때만 필요합니다.
+
+사용 예:
+    python distill.py payshield_decisions.jsonl -o payshield_distilled.json --min-conf 0.8
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+BUCKETS = ["low", "mid", "high"]
+BUCKET_RANGES = {"low": (0.0, 30.0), "mid": (30.1, 60.0), "high": (60.1, 100.0)}
+
+FEATURE_NAMES = [
+    "log_ratio", "ratio_ge_1_5", "ratio_ge_3",
+    "log_freq", "freq_zero", "low_freq_high_amt",
+    "night", "country_nonKR",
+    "ip_geo_shift", "vpn", "device_change", "bot_like",
+]
+
+def featurize(features: dict) -> list:
+    """앱의 features dict → 모델 입력 벡터 (프롬프트의 가중치 가이드를 따름)."""
+    ratio = features["amount"] / max(1, features["avg_amt"])
+    hour = features["hour"]
+    freq = features["freq"]
+    return [
+        math.log1p(ratio), float(ratio >= 1.5), float(ratio >= 3),
+        math.log1p(freq), float(freq == 0), float(features["amount"] > 50_000 and freq < 3),
+        float(hour <= 5 or hour >= 23), float(features["country"] != "KR"),
+        float(features["ip_geo_shift"]), float(features["vpn"]),
+        float(features["device_change"]), float(features["bot_like"]),
+    ]
+
+# ---------------------------
+# 서빙: 의존성 없는 로더
+# ---------------------------
+class DistilledScorer:
+    """JSON 아티팩트를 불러와 {risk_score, bucket, confidence}를 계산."""
+
+    def __init__(self, params: dict):
+        if params.get("feature_names") != FEATURE_NAMES:
+            raise ValueError("아티팩트의 피처 구성이 현재 featurize()와 다릅니다. 다시 학습하세요.")
+        self.params = params
+        self.mean = params["mean"]
+        self.scale = params["scale"]
+        self.bucket_w = params["bucket_w"]  # 클래스별 가중치 목록
+        self.bucket_b = params["bucket_b"]
+        self.score_w = params["score_w"]
+        self.score_b = params["score_b"]
+        self.min_confidence = params.get("min_confidence", 0.8)
+        d = len(FEATURE_NAMES)
+        if (len(self.mean) != d or len(self.scale) != d or len(self.score_w) != d
+                or len(self.bucket_w) != len(BUCKETS) or len(self.bucket_b) != len(BUCKETS)
+                or any(len(ws) != d for ws in self.bucket_w)):
+            raise ValueError("아티팩트의 가중치 크기가 피처/버킷 수와 맞지 않습니다.")
+
+    @classmethod
+    def load(cls, path: str) -> "DistilledScorer":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def predict(self, features: dict) -> dict:
+        z = [(x - m) / s for x, m, s in zip(featurize(features), self.mean, self.scale)]
+        logits = [sum(w * x for w, x in zip(ws, z)) + b for ws, b in zip(self.bucket_w, self.bucket_b)]
+        top = max(logits)
+        exps = [math.exp(v - top) for v in logits]
+        k = max(range(len(exps)), key=exps.__getitem__)
+        bucket = BUCKETS[k]
+        lo, hi = BUCKET_RANGES[bucket]
+        score = sum(w * x for w, x in zip(self.score_w, z)) + self.score_b
+        return dict(
+            risk_score=round(max(lo, min(hi, score)), 1),
+            bucket=bucket,
+            confidence=round(exps[k] / sum(exps), 3),
+        )
+
+# ---------------------------
+# 학습
+# ---------------------------
+LOG_FEATURE_KEYS = ("amount", "avg_amt", "freq", "hour", "country",
+                    "ip_geo_shift", "vpn", "device_change", "bot_like")
+
+def load_log(path: str) -> tuple:
+    """
+    JSONL 로그에서 유효한 레코드만 읽어 (rows, skipped)를 반환.
+    여러 세션이 이어 쓰는 로그라 프로세스 종료 등으로 잘린 줄이 있을 수 있으므로
+    파싱할 수 없거나 필드가 빠진 줄은 건너뛰고 개수만 센다.
+    """
+    rows, skipped = [], 0
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+                ok = (
+                    rec.get("bucket") in BUCKETS
+                    and isinstance(rec.get("risk_score"), (int, float))
+                    and all(k in rec["features"] for k in LOG_FEATURE_KEYS)
+                )
+            except (ValueError, AttributeError, KeyError, TypeError):
+                ok = False
+            if ok:
+                rows.append(rec)
+            else:
+                skipped += 1
+    return rows, skipped
+
+def train(rows: list, l2: float = 1e-3, lr: float = 0.5, epochs: int = 2000) -> dict:
+    """로그 레코드로 버킷 분류기와 점수 회귀를 학습해 아티팩트 dict를 반환."""
+    import numpy as np
+
+    X = np.array([featurize(r["features"]) for r in rows], dtype=float)
+    y = np.array([BUCKETS.index(r["bucket"]) for r in rows])
+    s = np.array([float(r["risk_score"]) for r in rows])
+
+    mean = X.mean(axis=0)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    Z = (X - mean) / scale
+    n, d = Z.shape
+
+    # 다항 로지스틱 회귀 (전체 배치 경사하강)
+    Y = np.eye(len(BUCKETS))[y]
+    W = np.zeros((len(BUCKETS), d))
+    b = np.zeros(len(BUCKETS))
+    for _ in range(epochs):
+        logits = Z @ W.T + b
+        logits -= logits.max(axis=1, keepdims=True)
+        P = np.exp(logits)
+        P /= P.sum(axis=1, keepdims=True)
+        G = (P - Y) / n
+        W -= lr * (G.T @ Z + l2 * W)
+        b -= lr * G.sum(axis=0)
+
+    # 릿지 회귀 (닫힌 해, 절편은 규제하지 않음)
+    Z1 = np.hstack([Z, np.ones((n, 1))])
+    reg = l2 * n * np.eye(d + 1)
+    reg[-1, -1] = 0.0
+    w = np.linalg.solve(Z1.T @ Z1 + reg, Z1.T @ s)
+
+    return dict(
+        version=1,
+        feature_names=FEATURE_NAMES,
+        mean=mean.tolist(),
+        scale=scale.tolist(),
+        bucket_w=W.tolist(),
+        bucket_b=b.tolist(),
+        score_w=w[:-1].tolist(),
+        score_b=float(w[-1]),
+        n_train=n,
+    )
+
+def evaluate(scorer: DistilledScorer, rows: list, min_conf: float) -> dict:
+    """홀드아웃에서 LLM 판단과의 일치도, 신뢰도 기준 이상에서의 커버리지/일치도를 계산."""
+    confusion = [[0] * len(BUCKETS) for _ in BUCKETS]
+    agree = conf_n = conf_agree = 0
+    abs_err = 0.0
+    t0 = time.perf_counter()
+    preds = [scorer.predict(r["features"]) for r in rows]
+    per_call_us = (time.perf_counter() - t0) / max(1, len(rows)) * 1e6
+    for r, p in zip(rows, preds):
+        hit = p["bucket"] == r["bucket"]
+        confusion[BUCKETS.index(r["bucket"])][BUCKETS.index(p["bucket"])] += 1
+        agree += hit
+        abs_err += abs(p["risk_score"] - float(r["risk_score"]))
+        if p["confidence"] >= min_conf:
+            conf_n += 1
+            conf_agree += hit
+    n = max(1, len(rows))
+    return dict(
+        n_holdout=len(rows),
+        bucket_agreement=round(agree / n, 3),
+        score_mae=round(abs_err / n, 2),
+        confusion=confusion,  # 행: LLM 버킷, 열: 로컬 모델 버킷 (low/mid/high)
+        min_confidence=min_conf,
+        coverage=round(conf_n / n, 3),  # 로컬에서 처리되는(LLM 호출이 빠지는) 비율
+        confident_agreement=round(conf_agree / conf_n, 3) if conf_n else None,
+        predict_us=round(per_call_us, 2),
+    )
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="LLM 위험 판단 로그로 로컬 증류 모델 학습")
+    ap.add_argument("log", help="PAYSHIELD_DECISION_LOG JSONL 파일")
+    ap.add_argument("-o", "--out", default="payshield_distilled.json", help="아티팩트 저장 경로")
+    ap.add_argument("--holdout", type=float, default=0.2, help="홀드아웃 비율")
+    ap.add_argument("--min-conf", type=float, default=0.8, help="로컬 모델을 쓰는 최소 신뢰도")
+    ap.add_argument("--l2", type=float, default=1e-3)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    rows, skipped = load_log(args.log)
+    if len(rows) < 10:
+        raise SystemExit(f"학습 데이터가 너무 적습니다 ({len(rows)}건)")
+    random.Random(args.seed).shuffle(rows)
+    n_hold = int(len(rows) * args.holdout)
+    hold, tr = rows[:n_hold], rows[n_hold:]
+
+    params = train(tr, l2=args.l2)
+    params["min_confidence"] = args.min_conf
+    params["llm_models"] = sorted({r.get("model", "") for r in rows} - {""})
+    params["skipped_lines"] = skipped
+    if hold:
+        params["holdout"] = evaluate(DistilledScorer(params), hold, args.min_conf)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(params, f, ensure_ascii=False, indent=2)
+    print(json.dumps(params.get("holdout", {"n_holdout": 0}), ensure_ascii=False, indent=2))
+    print(f"saved: {args.out} (train={len(tr)}, holdout={len(hold)}, skipped={skipped})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+# loadtest.py
+"""
+PayShield Streamlit 앱 동시 세션 부하 테스트.
+
+Streamlit 서버를 직접 띄우고, 가상 사용자 N명이 브라우저와 같은 웹소켓 프로토콜
+(/_stcore/stream, BackMsg/ForwardMsg protobuf)로
+  폼 입력 → 위험 분석 → 구간별 퍼즐 → 결제 승인
+흐름을 반복합니다. OpenAI 백엔드는 지연시간을 조절할 수 있는 로컬 모의 서버로 대체합니다.
+동시 사용자 수별로 rerun 지연(p50/p95/max)과 서버 프로세스 CPU/메모리 사용량을 출력합니다.
+
+사용 예:
+    python loadtest.py --app streamlit_app.py --users 1,5,10,20 --duration 30 --mock-latency 0.8
+    python loadtest.py --app new_streamlit_app.py --users 1,10,50 --out capacity.json
+
+근사 캐시 없이 측정하려면 PAYSHIELD_CACHE_TOL=-1 환경변수를 함께 지정하세요.
+웹소켓 클라이언트로 websockets>=13 이 필요합니다(`pip install "websockets>=13"`).
+서버와 같은 인터프리터의 Streamlit 버전을 따라 위젯 상태를 보냅니다. multiselect는 1.45부터
+옵션 문자열(string_array_value), 그 전에는 옵션 인덱스(int_array_value)로 보냅니다.
+Streamlit 1.44, 1.66에서 검증했습니다.
+CPU/메모리 측정에는 psutil이 필요합니다(없으면 해당 열은 비워 둡니다).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit
+from packaging.version import Version
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.asyncio.client import connect
+
+try:
+    import psutil
+except ImportError:  # CPU/메모리 측정은 선택 사항
+    psutil = None
+
+# 앱의 퍼즐 정답 (앱 코드와 동일하게 유지)
+ANIMALS = ["호랑이", "토끼", "고래"]
+ORDER_TARGET = "나는 오늘 35000원을 홍길동에게 보냅니다"
+
+MAX_CONSECUTIVE_FAILURES = 5  # 연속 실패 시 해당 가상 사용자 중단
+
+# Streamlit 1.45 미만은 multiselect 상태를 옵션 인덱스로 역직렬화한다
+MULTISELECT_BY_INDEX = Version(streamlit.__version__) < Version("1.45")
+
+# ---------------------------
+# OpenAI 모의 서버
+# ---------------------------
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """POST /v1/responses 에 지연 후 RiskSchema 형식의 응답을 돌려준다."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        req = json.loads(body or b"{}")
+        srv = self.server
+        time.sleep(max(0.0, srv.rng.gauss(srv.latency, srv.jitter)))
+        with srv.lock:
+            srv.calls += 1
+            rs = round(srv.rng.uniform(0, 100), 1)
+        risk = {
+            "risk_score": rs,
+            "bucket": "low" if rs <= 30 else "mid" if rs <= 60 else "high",
+            "reasons": ["모의 응답", "부하 테스트"],
+            "indicators": {},
+        }
+        payload = json.dumps({
+            "id": "resp_mock",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": req.get("model", "mock"),
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": "msg_mock",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": json.dumps(risk), "annotations": []}],
+            }],
+            "parallel_tool_calls": False,
+            "tool_choice": "auto",
+            "tools": [],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+@contextmanager
+def mock_openai(latency: float, jitter: float, seed: int):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAIHandler)
+    srv.daemon_threads = True
+    srv.latency, srv.jitter = latency, jitter
+    srv.rng, srv.lock, srv.calls = random.Random(seed), threading.Lock(), 0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        yield srv
+    finally:
+        srv.shutdown()
+
+# ---------------------------
+# Streamlit 서버 실행
+# ---------------------------
+@contextmanager
+def streamlit_server(app: str, port: int, openai_url: str, timeout: float = 30.0):
+    env = dict(os.environ, OPENAI_API_KEY="mock-key", OPENAI_BASE_URL=openai_url)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", app,
+         "--server.headless", "true", "--server.port", str(port),
+         "--server.enableCORS", "false", "--server.enableXsrfProtection", "false",
+         "--browser.gatherUsageStats", "false"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f"Streamlit 서버가 시작 중 종료되었습니다 (code={proc.returncode})")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise SystemExit("Streamlit 서버 health check 시간 초과")
+                time.sleep(0.3)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+# ---------------------------
+# 가상 사용자
+# ---------------------------
+class CheckoutError(Exception):
+    pass
+
+class Page:
+    """한 번의 스크립트 실행 결과: 라벨 → (위젯 종류, id), 화면 텍스트."""
+
+    def __init__(self):
+        self.widgets = {}
+        self.options = {}  # multiselect id → 옵션 목록
+        self.texts = []
+        self.exceptions = []
+
+    def add(self, element):
+        kind = element.WhichOneof("type")
+        proto = getattr(element, kind)
+        if kind == "exception":
+            self.exceptions.append(f"{proto.type}: {proto.message}")
+        wid = getattr(proto, "id", "")
+        if wid:
+            self.widgets[proto.label] = (kind, wid)
+            if kind == "multiselect":
+                self.options[wid] = list(proto.options)
+        body = getattr(proto, "body", "")
+        if body:
+            self.texts.append(body)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+    def widget(self, label_prefix: str):
+        for label, w in self.widgets.items():
+            if label.startswith(label_prefix):
+                return w
+        raise CheckoutError(f"위젯을 찾을 수 없음: {label_prefix!r}")
+
+def widget_state(kind: str, wid: str, value) -> WidgetState:
+    ws = WidgetState(id=wid)
+    if kind == "button":
+        ws.trigger_value = True
+    elif kind == "checkbox":
+        ws.bool_value = bool(value)
+    elif kind == "number_input":
+        ws.double_value = float(value)
+    elif kind == "slider":
+        ws.double_array_value.data[:] = [float(value)]
+    elif kind == "text_input":
+        ws.string_value = str(value)
+    elif kind == "multiselect" and MULTISELECT_BY_INDEX:
+        ws.int_array_value.data[:] = list(value)  # VirtualUser.set에서 인덱스로 변환됨
+    elif kind == "multiselect":
+        ws.string_array_value.data[:] = list(value)
+    else:
+        raise CheckoutError(f"지원하지 않는 위젯: {kind}")
+    return ws
+
+class VirtualUser:
+    """웹소켓 세션 하나로 결제 시나리오 1회를 수행하고 rerun 지연을 기록한다."""
+
+    def __init__(self, url: str, rng: random.Random, rerun_timeout: float = 30.0):
+        self.url = url
+        self.rng = rng
+        self.rerun_timeout = rerun_timeout
+        self.latencies = []
+
+    async def checkout(self):
+        async with connect(self.url, subprotocols=["streamlit"], max_size=None) as ws:
+            self.ws, self.values, self.page_hash = ws, {}, ""
+            page = await self.rerun()
+
+            # 0) 결제 요청 입력 → 1) 위험 분석
+            rng = self.rng
+            self.set(page, "결제 금액(원)", rng.randrange(5_000, 300_000, 1_000))
+            self.set(page, "결제 국가/지역", rng.choice(["KR", "US", "JP", "CN"]))
+            self.set(page, "결제 시간", rng.randint(0, 23))
+            self.set(page, "최근 30일 결제 횟수", rng.randint(0, 30))
+            self.set(page, "최근 30일 평균 결제금액(원)", rng.randrange(5_000, 100_000, 1_000))
+            for label in ("새 디바이스", "VPN/프록시", "평소 지역과 다른", "비정상 입력 속도"):
+                self.set(page, label, rng.random() < 0.3)
+            page = await self.rerun(trigger=page.widget("1)"))
+            if "OpenAI 호출 실패" in page.text:
+                raise CheckoutError("위험 분석 실패")
+
+            # 3) 구간별 퍼즐
+            text = page.text
+            if m := re.search(r"\*\*(\d+) \+ (\d+) = \?\*\*", text):
+                self.set(page, "정답 입력", int(m[1]) + int(m[2]))
+            elif m := re.search(r"\*\*(\d+) - (\d+) = \?\*\*", text):
+                self.set(page, "정답(정수)", int(m[1]) - int(m[2]))
+                self.set(page, "모두 선택", ANIMALS)
+            else:
+                self.set(page, "토큰을 순서대로 클릭", ORDER_TARGET.split())
+            page = await self.rerun(trigger=page.widget("정답 확인"))
+
+            # 4) 결제 승인
+            self.set(page, "위 결제 요청을 승인합니다.", True)
+            page = await self.rerun(trigger=page.widget("결제 승인"))
+            if "결제가 완료되었습니다" not in page.text:
+                raise CheckoutError("결제 완료 화면이 나타나지 않음")
+
+    def set(self, page: Page, label_prefix: str, value):
+        kind, wid = page.widget(label_prefix)
+        if kind == "multiselect" and MULTISELECT_BY_INDEX:
+            value = [page.options[wid].index(v) for v in value]
+        self.values[wid] = (kind, value)
+
+    async def rerun(self, trigger=None) -> Page:
+        msg = BackMsg()
+        rs = msg.rerun_script
+        rs.page_script_hash = self.page_hash
+        for wid, (kind, value) in self.values.items():
+            rs.widget_states.widgets.append(widget_state(kind, wid, value))
+        if trigger is not None:
+            rs.widget_states.widgets.append(widget_state(*trigger, True))
+
+        t0 = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.rerun_timeout):
+                page = await self._run_script(msg)
+        except TimeoutError:
+            # 포화 상태의 지연도 분포에 남도록 시간 초과까지 걸린 시간을 기록
+            self.latencies.append(time.perf_counter() - t0)
+            raise CheckoutError(f"rerun 시간 초과 ({self.rerun_timeout}s)") from None
+        self.latencies.append(time.perf_counter() - t0)
+        if page.exceptions:
+            raise CheckoutError(f"스크립트 예외: {page.exceptions[0]}")
+        return page
+
+    async def _run_script(self, msg: BackMsg) -> Page:
+        """rerun 요청을 보내고 script_finished까지 받은 요소로 Page를 만든다."""
+        await self.ws.send(msg.SerializeToString())
+        page = Page()
+        while True:
+            fm = ForwardMsg()
+            fm.ParseFromString(await self.ws.recv())
+            kind = fm.WhichOneof("type")
+            if kind == "new_session":
+                self.page_hash = fm.new_session.page_script_hash
+            elif kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                page.add(fm.delta.new_element)
+            elif kind == "script_finished":
+                if fm.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    page = Page()
+                    continue
+                return page
+
+# ---------------------------
+# 동시 사용자 수별 측정
+# ---------------------------
+class ResourceSampler:
+    """Streamlit 서버 프로세스의 CPU/RSS를 주기적으로 샘플링."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.proc = psutil.Process(pid) if psutil else None
+        self.interval = interval
+        self.cpu, self.rss = [], []
+
+    def cpu_time(self) -> float:
+        t = self.proc.cpu_times()
+        return t.user + t.system
+
+    async def run(self):
+        self.proc.cpu_percent(None)
+        while True:
+            await asyncio.sleep(self.interval)
+            self.cpu.append(self.proc.cpu_percent(None))
+            self.rss.append(self.proc.memory_info().rss)
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+async def run_level(url: str, pid: int, users: int, duration: float, ramp: float, seed: int,
+                    rerun_timeout: float = 30.0) -> dict:
+    loop = asyncio.get_running_loop()
+    latencies, errors = [], []
+    done = 0
+
+    async def worker(i: int):
+        nonlocal done
+        rng = random.Random(seed * 100_003 + i)
+        await asyncio.sleep(rng.uniform(0, ramp))
+        failures = 0
+        while loop.time() < deadline:
+            vu = VirtualUser(url, rng, rerun_timeout)
+            try:
+                await vu.checkout()
+                done += 1
+                failures = 0
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                failures += 1
+            finally:
+                latencies.extend(vu.latencies)
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                break
+            if failures:
+                await asyncio.sleep(min(2.0, 0.1 * 2 ** failures))  # 즉시 재시도 폭주 방지
+
+    sampler = ResourceSampler(pid)
+    rss0 = sampler.proc.memory_info().rss if sampler.proc else None
+    cpu0 = sampler.cpu_time() if sampler.proc else None
+    sampling = asyncio.create_task(sampler.run()) if sampler.proc else None
+
+    deadline = loop.time() + ramp + duration
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(users)))
+    elapsed = time.perf_counter() - t0
+    if sampling:
+        sampling.cancel()
+
+    row = dict(
+        users=users,
+        checkouts=done,
+        errors=len(errors),
+        reruns=len(latencies),
+        checkouts_per_s=round(done / elapsed, 2),
+        p50_ms=None, p95_ms=None, max_ms=None,
+        cpu_pct=None, cpu_ms_per_checkout=None,
+        rss_mb=None, rss_mb_per_session=None,
+        first_error=errors[0] if errors else None,
+    )
+    if latencies:
+        row.update(
+            p50_ms=round(percentile(latencies, 50) * 1000, 1),
+            p95_ms=round(percentile(latencies, 95) * 1000, 1),
+            max_ms=round(max(latencies) * 1000, 1),
+        )
+    if sampler.proc and sampler.rss:
+        peak = max(sampler.rss)
+        row.update(
+            cpu_pct=round(statistics.mean(sampler.cpu), 1),
+            cpu_ms_per_checkout=round((sampler.cpu_time() - cpu0) * 1000 / max(1, done), 1),
+            rss_mb=round(peak / 2**20, 1),
+            rss_mb_per_session=round((peak - rss0) / 2**20 / users, 2),
+        )
+    return row
+
+COLUMNS = ["users", "checkouts", "errors", "checkouts_per_s", "p50_ms", "p95_ms", "max_ms",
+           "cpu_pct", "cpu_ms_per_checkout", "rss_mb", "rss_mb_per_session"]
+
+def print_table(rows):
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in COLUMNS]
+    print("  ".join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+    for r in rows:
+        print("  ".join(str(r[c] if r[c] is not None else "-").rjust(w) for c, w in zip(COLUMNS, widths)))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="PayShield Streamlit 동시 세션 부하 테스트")
+    ap.add_argument("--app", default="streamlit_app.py", help="대상 Streamlit 스크립트")
+    ap.add_argument("--users", default="1,5,10,20", help="동시 사용자 수 목록 (쉼표 구분)")
+    ap.add_argument("--duration", type=float, default=30.0, help="단계별 측정 시간(초)")
+    ap.add_argument("--ramp", type=float, default=2.0, help="사용자 시작 분산 시간(초)")
+    ap.add_argument("--mock-latency", type=float, default=0.8, help="모의 OpenAI 평균 지연(초)")
+    ap.add_argument("--mock-jitter", type=float, default=0.2, help="모의 OpenAI 지연 표준편차(초)")
+    ap.add_argument("--rerun-timeout", type=float, default=30.0, help="rerun 1회 최대 대기(초), 초과 시 실패 처리")
+    ap.add_argument("--port", type=int, default=8599)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="결과를 JSON으로 저장할 경로")
+    args = ap.parse_args(argv)
+
+    levels = [int(u) for u in args.users.split(",")]
+    if psutil is None:
+        print("psutil이 없어 CPU/메모리 측정을 생략합니다.", file=sys.stderr)
+
+    rows = []
+    with mock_openai(args.mock_latency, args.mock_jitter, args.seed) as mock:
+        openai_url = f"http://127.0.0.1:{mock.server_address[1]}/v1"
+        with streamlit_server(args.app, args.port, openai_url) as proc:
+            url = f"ws://127.0.0.1:{args.port}/_stcore/stream"
+            # 첫 실행의 import/캐시 비용이 1단계 측정에 섞이지 않도록 한 번 예열
+            asyncio.run(VirtualUser(url, random.Random(args.seed), args.rerun_timeout).checkout())
+            for users in levels:
+                calls0 = mock.calls
+                row = asyncio.run(run_level(url, proc.pid, users, args.duration, args.ramp, args.seed,
+                                            args.rerun_timeout))
+                row["openai_calls"] = mock.calls - calls0
+                rows.append(row)
+                print(f"[{users} users] p95={row['p95_ms']}ms checkouts={row['checkouts']} "
+                      f"errors={row['errors']}", file=sys.stderr)
+
+    print_table(rows)
+    for r in rows:
+        if r["first_error"]:
+            print(f"users={r['users']} 첫 오류: {r['first_error']}", file=sys.stderr)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(dict(app=args.app, mock_latency=args.mock_latency, rows=rows),
+                      f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
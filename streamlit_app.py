@@ -1,13 +1,20 @@
 # streamlit_app.py
 import os
 import json
+import logging
+import math
 import random
+import threading
 import time
+from bisect import bisect_right
+from collections import OrderedDict, deque
 from datetime import datetime
 
 import streamlit as st
 from openai import OpenAI
 
+from distill import DistilledScorer
+
 st.set_page_config(page_title="AI Adaptive PayShield – OpenAI Risk", page_icon="💳", layout="centered")
 
 # ---------------------------
@@ -18,6 +25,24 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 MODEL_NAME = os.getenv("PAYSHIELD_MODEL", "gpt-4o-mini")  # 필요시 gpt-4o 등으로 교체
 TEMPERATURE = float(os.getenv("PAYSHIELD_TEMP", "0.2"))
+DEBUG = os.getenv("PAYSHIELD_DEBUG", "") not in ("", "0")  # 운영 통계 화면 노출 여부
+
+logger = logging.getLogger("payshield")
+
+# 근사 캐시: 격자 거리 허용치(음수면 캐시 끔), 적중 시 재검증 비율, 최소 버킷 일치율
+CACHE_TOL = int(os.getenv("PAYSHIELD_CACHE_TOL", "1"))
+CACHE_AUDIT_RATE = float(os.getenv("PAYSHIELD_CACHE_AUDIT", "0.05"))
+CACHE_MIN_AGREE = float(os.getenv("PAYSHIELD_CACHE_MIN_AGREE", "0.9"))
+CACHE_MAX_KEYS = 5_000     # exact 키 최대 개수 (LRU, 키당 격자 칸은 최대 25개)
+AUDIT_WINDOW = 200         # 일치율은 최근 재검증 N건으로만 판단 (캐시/증류 모델 공통)
+AUDIT_AGREE_Z = 1.645      # 일치율 하한(Wilson, 단측 95%)으로 기준 비교
+
+# 증류 모델: OpenAI 판단 로그(JSONL) 경로, distill.py 아티팩트 경로, 로컬 판단 최소 신뢰도
+DECISION_LOG = os.getenv("PAYSHIELD_DECISION_LOG")
+DISTILLED_PATH = os.getenv("PAYSHIELD_DISTILLED")
+DISTILLED_MIN_CONF = os.getenv("PAYSHIELD_DISTILLED_MIN_CONF")  # 미지정 시 아티팩트 값 사용
+DISTILLED_SHADOW_RATE = float(os.getenv("PAYSHIELD_DISTILLED_SHADOW", "0.02"))  # 로컬 판단 중 OpenAI 재검증 비율
+DISTILLED_MIN_AGREE = float(os.getenv("PAYSHIELD_DISTILLED_MIN_AGREE", "0.9"))
 
 # ---------------------------
 # 세션 상태 초기화
@@ -83,7 +108,7 @@ RISK_SCHEMA = {
             },
             "indicators": {
                 "type": "object",
-                "additionalProperties": True,
+                "additionalProperties": False,
                 "properties": {
                     "amount_vs_avg": {"type": "number"},
                     "night": {"type": "boolean"},
@@ -92,7 +117,11 @@ RISK_SCHEMA = {
                     "vpn": {"type": "boolean"},
                     "device_change": {"type": "boolean"},
                     "bot_like": {"type": "boolean"},
-                }
+                },
+                "required": [
+                    "amount_vs_avg", "night", "country_nonKR",
+                    "ip_geo_shift", "vpn", "device_change", "bot_like",
+                ]
             }
         },
         "required": ["risk_score", "bucket", "reasons", "indicators"]
@@ -130,7 +159,7 @@ def compute_risk_with_openai(features: dict) -> dict:
         instructions="Return only JSON that matches the provided schema.",
         input=build_prompt(features),
         temperature=TEMPERATURE,
-        response_format={"type": "json_schema", "json_schema": RISK_SCHEMA},
+        text={"format": {"type": "json_schema", **RISK_SCHEMA}},
     )
     # structured outputs → JSON 문자열
     data = json.loads(resp.output_text)
@@ -141,6 +170,300 @@ def compute_risk_with_openai(features: dict) -> dict:
     data["bucket"] = bucket
     return data
 
+def build_indicators(features: dict) -> dict:
+    """현재 거래의 피처로 indicators를 계산 (캐시·로컬 결과가 다른 거래의 값을 보이지 않도록)."""
+    hour = features["hour"]
+    return dict(
+        amount_vs_avg=round(features["amount"] / max(1, features["avg_amt"]), 2),
+        night=hour <= 5 or hour >= 23,
+        country_nonKR=features["country"] != "KR",
+        ip_geo_shift=features["ip_geo_shift"],
+        vpn=features["vpn"],
+        device_change=features["device_change"],
+        bot_like=features["bot_like"],
+    )
+
+# ---------------------------
+# 근사(격자) 캐시
+# ---------------------------
+# 금액 비율/빈도를 구간으로 나눠 서로 조금씩 다른 거래도 같은 격자 근처에 모이게 한다.
+# 프롬프트의 기준선(ratio>=3, 심야)은 exact 키에 넣어 허용치가 이를 넘나들지 못하게 한다.
+RATIO_TIERS = (3.0, 5.0)                       # exact: ratio<3 / 3~5 / >=5
+RATIO_BANDS = (0.5, 1.0, 1.5, 2.0)             # approx: ratio<3 구간 내 세분 (3 이상은 동일)
+FREQ_BANDS = (1, 3, 10, 30)                    # 최근 30일 결제 횟수
+LOW_FREQ = 3                                   # exact: 저빈도(고액이면 추가↑) 여부
+
+def cache_key(features: dict) -> tuple:
+    """
+    피처를 (exact, approx) 격자 키로 이산화.
+    exact: 국가·심야 여부·금액비율 단계·저빈도 여부·불리언 신호 → 반드시 일치
+    approx: 금액비율/빈도 구간 번호 → 격자 거리(L1) 허용치 이내면 이웃
+    """
+    hour = features["hour"]
+    ratio = features["amount"] / max(1, features["avg_amt"])
+    exact = (
+        features["country"], hour <= 5 or hour >= 23,
+        bisect_right(RATIO_TIERS, ratio), features["freq"] < LOW_FREQ,
+        features["ip_geo_shift"], features["vpn"],
+        features["device_change"], features["bot_like"],
+    )
+    approx = (
+        bisect_right(RATIO_BANDS, ratio),
+        bisect_right(FREQ_BANDS, features["freq"]),
+    )
+    return exact, approx
+
+class AuditWindow:
+    """
+    최근 재검증(제공한 결과 vs 새 OpenAI 결과)의 버킷 일치율/점수 오차를 AUDIT_WINDOW건 단위로 추적.
+    창이 가득 차고 일치율의 신뢰 하한이 min_agree 이상일 때만 serving이며, 그 전에는 모든 건을
+    재검증한다. serving 중 기준 아래로 떨어지면 창을 비우고 같은 조건을 다시 채워야 재개한다.
+    """
+
+    def __init__(self, min_agree: float):
+        self.min_agree = min_agree
+        self._window = deque(maxlen=AUDIT_WINDOW)  # (버킷 일치 여부, 점수 절대오차)
+        self._lock = threading.Lock()
+        self._rng = random.Random()  # 앱이 세션 시드로 전역 random을 고정하므로 별도 사용
+
+    def _agreement(self) -> float:
+        w = self._window
+        return sum(a for a, _ in w) / len(w) if w else 0.0
+
+    def _agreement_lower(self) -> float:
+        """창 일치율의 Wilson 신뢰 하한. 표본 잡음으로 기준을 잠깐 넘는 경우를 거른다."""
+        n, p, z = len(self._window), self._agreement(), AUDIT_AGREE_Z
+        if n == 0:
+            return 0.0
+        center = p + z * z / (2 * n)
+        margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        return (center - margin) / (1 + z * z / n)
+
+    def _serving(self) -> bool:
+        w = self._window
+        return len(w) == w.maxlen and self._agreement_lower() >= self.min_agree
+
+    @property
+    def serving(self) -> bool:
+        with self._lock:
+            return self._serving()
+
+    def should_audit(self, rate: float) -> bool:
+        """serving이 아니면 항상, serving 중에는 rate 비율로 재검증."""
+        with self._lock:
+            return not self._serving() or self._rng.random() < rate
+
+    def add(self, served: dict, fresh: dict):
+        with self._lock:
+            was_serving = self._serving()
+            self._window.append((
+                served["bucket"] == fresh["bucket"],
+                abs(served["risk_score"] - fresh["risk_score"]),
+            ))
+            if was_serving and not self._serving():
+                self._window.clear()
+
+    def summary(self) -> dict:
+        with self._lock:
+            w = list(self._window)
+            return dict(
+                window=len(w),
+                bucket_agreement=round(self._agreement(), 3) if w else None,
+                mean_abs_err=round(sum(e for _, e in w) / len(w), 2) if w else None,
+                serving=self._serving(),
+            )
+
+class ApproxRiskCache:
+    """
+    세션 간 공유되는 근사 캐시.
+    적중 결과 중 일부는 새로 OpenAI를 호출해 AuditWindow로 일치율을 추적하고,
+    일치율이 기준을 만족할 때만 캐시 결과를 제공한다.
+    """
+
+    def __init__(self, tol: int, audit_rate: float, min_agree: float):
+        self.tol = tol
+        self.audit_rate = audit_rate
+        self.audit = AuditWindow(min_agree)
+        self._store = OrderedDict()  # exact -> {approx: data}, 오래 안 쓴 exact 키부터 제거
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0, audits=0)
+
+    def lookup(self, features: dict):
+        """허용치 이내 가장 가까운 이웃의 (결과, 거리). 없으면 (None, None)."""
+        if self.tol < 0:
+            return None, None
+        exact, approx = cache_key(features)
+        with self._lock:
+            cells = self._store.get(exact)
+            if cells is None:
+                return None, None
+            self._store.move_to_end(exact)
+            best, best_d = None, None
+            for key, data in cells.items():
+                d = sum(abs(a - b) for a, b in zip(key, approx))
+                if d <= self.tol and (best_d is None or d < best_d):
+                    best, best_d = data, d
+            return (dict(best), best_d) if best is not None else (None, None)
+
+    def put(self, features: dict, data: dict):
+        if self.tol < 0:
+            return
+        exact, approx = cache_key(features)
+        with self._lock:
+            self._store.setdefault(exact, {})[approx] = dict(data)
+            self._store.move_to_end(exact)
+            # country는 자유 입력이므로 키 수를 제한해 메모리가 무한히 늘지 않게 한다
+            while len(self._store) > CACHE_MAX_KEYS:
+                self._store.popitem(last=False)
+
+    def should_audit(self) -> bool:
+        return self.audit.should_audit(self.audit_rate)
+
+    def record(self, source: str, cached: dict = None, fresh: dict = None):
+        """source: 'hit' | 'miss' | 'audit'(적중했지만 새로 호출해 비교)"""
+        with self._lock:
+            self.stats[{"hit": "hits", "miss": "misses"}.get(source, "audits")] += 1
+        if source == "audit":
+            self.audit.add(cached, fresh)
+
+    def summary(self) -> dict:
+        with self._lock:
+            s = dict(self.stats)
+        total = s["hits"] + s["misses"] + s["audits"]
+        return dict(
+            requests=total,
+            openai_calls=s["misses"] + s["audits"],
+            hit_rate=round(s["hits"] / max(1, total), 3),
+            audits=s["audits"],
+            **self.audit.summary(),
+        )
+
+@st.cache_resource
+def get_risk_cache() -> ApproxRiskCache:
+    return ApproxRiskCache(CACHE_TOL, CACHE_AUDIT_RATE, CACHE_MIN_AGREE)
+
+@st.cache_resource
+def get_log_lock() -> threading.Lock:
+    # 스크립트는 rerun마다 다시 실행되므로 세션 간 공유 락은 cache_resource로 유지
+    return threading.Lock()
+
+def log_decision(features: dict, data: dict, source: str = "openai", local: dict = None):
+    """
+    증류 학습용으로 OpenAI가 새로 판단한 결과를 JSONL에 한 줄씩 추가.
+    source: 'openai'(캐시 미스/재검증) | 'shadow'(로컬 판단을 OpenAI로 재검증, local에 로컬 결과)
+    기록 실패는 로그만 남기고 결제 흐름에는 영향을 주지 않는다.
+    """
+    if not DECISION_LOG:
+        return
+    rec = dict(
+        ts=datetime.now().isoformat(timespec="seconds"), model=MODEL_NAME, source=source,
+        features=features, risk_score=data["risk_score"], bucket=data["bucket"],
+    )
+    if local is not None:
+        rec.update(
+            local_risk_score=local["risk_score"], local_bucket=local["bucket"],
+            local_confidence=local["confidence"],
+        )
+    try:
+        with get_log_lock(), open(DECISION_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    except OSError:
+        logger.warning("decision log write failed: %s", DECISION_LOG, exc_info=True)
+
+def cached_result(cached: dict, features: dict, distance: int) -> dict:
+    """이웃의 risk_score/bucket만 재사용하고, 근거는 유사 거래 출처로 표시·indicators는 현재 거래로 재계산."""
+    return dict(
+        risk_score=cached["risk_score"],
+        bucket=cached["bucket"],
+        reasons=[f"유사 거래의 캐시된 판단 사용 (격자 거리 {distance})"]
+        + [f"[유사 거래] {r}" for r in cached.get("reasons", [])][:4],
+        indicators=build_indicators(features),
+    )
+
+def compute_risk_cached(features: dict):
+    """
+    근사 캐시를 거쳐 위험 점수를 계산.
+    (data, distance)를 반환하며, distance가 None이면 OpenAI를 새로 호출한 결과.
+    캐시가 serving 중일 때 재검증 호출이 실패하면 캐시 결과로 대신 응답한다.
+    """
+    cache = get_risk_cache()
+    cached, distance = cache.lookup(features)
+    serving = cache.audit.serving
+    if cached is not None and not cache.should_audit():
+        cache.record("hit")
+        return cached_result(cached, features, distance), distance
+
+    try:
+        data = compute_risk_with_openai(features)
+    except Exception:
+        # 신뢰 중인 캐시의 재검증 호출이 실패한 것뿐이면 캐시 결과로 응답
+        if cached is None or not serving:
+            raise
+        logger.warning("cache audit call failed, serving cached result", exc_info=True)
+        cache.record("hit")
+        return cached_result(cached, features, distance), distance
+    log_decision(features, data)
+    if cached is None:
+        cache.record("miss")
+    else:
+        cache.record("audit", cached, data)
+    cache.put(features, data)
+    return data, None
+
+# ---------------------------
+# 로컬 증류 모델 (distill.py)
+# ---------------------------
+@st.cache_resource
+def get_local_engine():
+    """
+    아티팩트와 신뢰도 기준을 한 번만 불러와 검증.
+    실패하면 로그를 남기고 None을 캐시해 OpenAI(근사 캐시) 경로만 사용한다.
+    """
+    if not DISTILLED_PATH:
+        return None
+    try:
+        scorer = DistilledScorer.load(DISTILLED_PATH)
+        min_conf = float(DISTILLED_MIN_CONF) if DISTILLED_MIN_CONF else float(scorer.min_confidence)
+        if not 0.0 <= min_conf <= 1.0:
+            raise ValueError(f"min_confidence는 0~1 범위여야 합니다: {min_conf}")
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.exception("distilled model disabled, falling back to OpenAI: %s", DISTILLED_PATH)
+        return None
+    return dict(scorer=scorer, min_conf=min_conf, audit=AuditWindow(DISTILLED_MIN_AGREE))
+
+def compute_risk_local(features: dict):
+    """
+    증류 모델의 신뢰도가 기준 이상이면 OpenAI 없이 결과를 반환.
+    모델이 없거나 신뢰도가 낮으면 None → OpenAI(근사 캐시) 경로로 넘어간다.
+    신뢰 구간의 판단도 일부(재검증 일치율이 기준 미달이면 전부)는 OpenAI로 섀도 호출해
+    일치율을 추적하고 로그·근사 캐시에 남기며, 이때는 OpenAI 결과를 반환한다.
+    serving 중의 섀도 호출은 재검증일 뿐이므로 실패하면 로컬 결과로 응답한다.
+    """
+    engine = get_local_engine()
+    if engine is None:
+        return None
+    pred = engine["scorer"].predict(features)
+    if pred["confidence"] < engine["min_conf"]:
+        return None
+    pred["reasons"] = ["로컬 증류 모델 판단", f"신뢰도 {pred['confidence']:.2f}"]
+    pred["indicators"] = build_indicators(features)
+
+    audit = engine["audit"]
+    serving = audit.serving
+    if not audit.should_audit(DISTILLED_SHADOW_RATE):
+        return pred
+    try:
+        data = compute_risk_with_openai(features)
+    except Exception:
+        if not serving:
+            raise
+        logger.warning("distilled shadow call failed, serving local result", exc_info=True)
+        return pred
+    audit.add(pred, data)
+    log_decision(features, data, source="shadow", local=pred)
+    get_risk_cache().put(features, data)
+    return data
+
 # ---------------------------
 # 1) 위험 분석 실행
 # ---------------------------
@@ -159,11 +482,17 @@ if submitted:
     try:
         st.session_state.api_error = None
         with st.spinner("OpenAI에 요청 중..."):
-            data = compute_risk_with_openai(features)
+            data, cache_distance = compute_risk_local(features), None
+            if data is None:
+                data, cache_distance = compute_risk_cached(features)
 
         st.session_state.risk_score = data["risk_score"]
         st.session_state.bucket = data["bucket"]
         st.success("위험 분석 완료! 아래 단계로 진행하세요.")
+        if "confidence" in data:
+            st.caption(f"로컬 증류 모델 결과 사용 (신뢰도 {data['confidence']:.2f})")
+        elif cache_distance is not None:
+            st.caption(f"유사 거래 캐시 결과 사용 (격자 거리 {cache_distance})")
         # 퍼즐 리셋
         st.session_state.puzzle_passed = False
         st.session_state.txn_confirmed = False
@@ -175,6 +504,17 @@ if submitted:
         with st.expander("모델 근거(Reasons / Indicators) 보기"):
             st.write(data.get("reasons", []))
             st.json(data.get("indicators", {}))
+
+        # 세션 간 공유 통계는 결제 화면이 아닌 서버 로그로 (PAYSHIELD_DEBUG=1이면 화면에도)
+        cache_stats = get_risk_cache().summary()
+        logger.info("risk cache stats: %s", cache_stats)
+        engine = get_local_engine()
+        local_stats = engine["audit"].summary() if engine else None
+        if local_stats:
+            logger.info("distilled model shadow stats: %s", local_stats)
+        if DEBUG:
+            with st.expander("[debug] 근사 캐시 / 증류 모델 통계"):
+                st.json(dict(cache=cache_stats, distilled=local_stats))
     except Exception as e:
         st.session_state.api_error = str(e)
         st.error(f"OpenAI 호출 실패: {e}")